@@ -67,6 +67,9 @@ def load_indexed_dataset(path, dictionary, dataset_impl=None, combine=False, def
         dataset_impl_k = dataset_impl
         if dataset_impl_k is None:
             dataset_impl_k = indexed_dataset.infer_dataset_impl(path_k)
+            if dataset_impl_k == 'cached':
+                print('| WARNING: {} is legacy indexed data and is cached in memory by every '
+                      'worker, re-binarize it with --dataset-impl=mmap to share it'.format(path_k))
 
         dataset = indexed_dataset.make_dataset(
             path_k,
@@ -139,11 +139,18 @@ class EpochBatchIterator(EpochBatchIterating):
             (default: 0).
         epoch (int, optional): the epoch to start the iterator from
             (default: 0).
+        pin_memory (bool, optional): copy batches into pinned memory so they
+            can be moved to the GPU asynchronously (default: False).
+        prefetch_factor (int, optional): number of batches loaded in advance
+            by each worker. None keeps the DataLoader default (default: None).
+        persistent_workers (bool, optional): keep the worker processes alive
+            and reuse them for every unshuffled epoch (default: False).
     """
 
     def __init__(
         self, dataset, collate_fn, batch_sampler, seed=1, num_shards=1, shard_id=0,
-        num_workers=0, epoch=0,
+        num_workers=0, epoch=0, pin_memory=False, prefetch_factor=None,
+        persistent_workers=False,
     ):
         assert isinstance(dataset, torch.utils.data.Dataset)
         self.dataset = dataset
@@ -153,10 +160,14 @@ class EpochBatchIterator(EpochBatchIterating):
         self.num_shards = num_shards
         self.shard_id = shard_id
         self.num_workers = num_workers
+        self.pin_memory = pin_memory
+        self.prefetch_factor = prefetch_factor
+        self.persistent_workers = persistent_workers and num_workers > 0
 
         self.epoch = epoch
         self._cur_epoch_itr = None
         self._next_epoch_itr = None
+        self._persistent_dataloader = None
         self._supports_prefetch = getattr(dataset, 'supports_prefetch', False)
 
     def __len__(self):
@@ -252,14 +263,31 @@ class EpochBatchIterator(EpochBatchIterating):
         if self.num_workers > 0:
             os.environ['PYTHONWARNINGS'] = 'ignore:semaphore_tracker:UserWarning'
 
-        return CountingIterator(
-            torch.utils.data.DataLoader(
-                self.dataset,
-                collate_fn=self.collate_fn,
-                batch_sampler=batches[offset:],
-                num_workers=self.num_workers,
-            ),
-            start=offset,
+        # unshuffled epochs always see the same batches, so their DataLoader (and
+        # its worker processes) can be shared across epochs
+        if self.persistent_workers and not shuffle and offset == 0:
+            if self._persistent_dataloader is None:
+                self._persistent_dataloader = self._build_dataloader(batches, persistent_workers=True)
+            dataloader = self._persistent_dataloader
+        else:
+            dataloader = self._build_dataloader(batches[offset:])
+
+        return CountingIterator(dataloader, start=offset)
+
+    def _build_dataloader(self, batches, persistent_workers=False):
+        kwargs = {}
+        if self.num_workers > 0:
+            # both options are rejected by DataLoader without worker processes
+            if self.prefetch_factor is not None:
+                kwargs['prefetch_factor'] = self.prefetch_factor
+            kwargs['persistent_workers'] = persistent_workers
+        return torch.utils.data.DataLoader(
+            self.dataset,
+            collate_fn=self.collate_fn,
+            batch_sampler=batches,
+            num_workers=self.num_workers,
+            pin_memory=self.pin_memory,
+            **kwargs
         )
 
 
@@ -26,17 +26,28 @@ class Conv2dSuper(nn.Conv2d):
         self.sample_in_dim = None
         self.sample_out_dim = None
         self.stride = stride
-        self.samples = {}
+
+        # the sampled weight and bias are kept as plain attributes, forward reads them directly
+        self._sampled_weight = None
+        self._sampled_bias = None
+        self._sample_key = None
+        self._contiguous = None
 
         self._reset_parameters(bias, uniform_, non_linear)
         self.profiling = False
 
+    @property
+    def samples(self):
+        if self._sample_key is None:
+            return {}
+        return {'weight': self._sampled_weight, 'bias': self._sampled_bias}
+
     def profile(self, mode=True):
         self.profiling = mode
 
     def sample_parameters(self, resample=False):
         if self.profiling or resample:
-            return self._sample_parameters()
+            return self._sample_parameters(resample=True)
         return self.samples
 
     def _reset_parameters(self, bias, uniform_, non_linear):
@@ -51,23 +62,53 @@ class Conv2dSuper(nn.Conv2d):
 
         self._sample_parameters()
 
-    def _sample_parameters(self):
-        self.samples['weight'] = sample_weight(self.weight, self.sample_in_dim, self.sample_out_dim)
-        self.samples['bias'] = self.bias
+    def _sample_parameters(self, resample=False):
+        # the sampled weight and bias are views of the super parameters, so they only
+        # need to be re-derived when the sampled dims change, the parameters are moved
+        # to new storage, or the grad mode differs from the one they were built under
+        key = (self.sample_in_dim, self.sample_out_dim, self.weight.data_ptr(), torch.is_grad_enabled())
+        if not resample and self._sample_key == key:
+            return self.samples
+
+        # never assign the bias Parameter itself, nn.Module would register it as a new parameter
+        self._sampled_weight = sample_weight(self.weight, self.sample_in_dim, self.sample_out_dim)
+        self._sampled_bias = None
         if self.bias is not None:
-            self.samples['bias'] = sample_bias(self.bias, self.sample_out_dim)
+            self._sampled_bias = sample_bias(self.bias, self.sample_out_dim)
+        self._sample_key = key
         return self.samples
 
+    def train(self, mode=True):
+        if mode:
+            # the weights will be updated again, so the frozen copy is stale
+            self._contiguous = None
+        return super().train(mode)
+
+    def _contiguous_weight(self):
+        # the sampled view is strided whenever sample_in_dim < super_in_dim, and cuDNN would
+        # reformat it on every call; while the weights are frozen keep one contiguous copy
+        # until the sampled view or the super weight changes
+        key = (self._sample_key, self.weight._version)
+        if self._contiguous is None or self._contiguous[0] != key:
+            self._contiguous = (key, self._sampled_weight.contiguous())
+        return self._contiguous[1]
+
     def forward(self, x):
-        self.sample_parameters()
-        return F.conv2d(x, self.samples['weight'], self.samples['bias'], stride=self.stride)
+        if self.profiling:
+            # tracing needs the slicing to happen inside the traced forward
+            self._sample_parameters(resample=True)
+
+        weight = self._sampled_weight
+        if not (self.training or self.profiling or torch.is_grad_enabled() or weight.is_contiguous()):
+            weight = self._contiguous_weight()
+        return F.conv2d(x, weight, self._sampled_bias, stride=self.stride)
 
     def calc_sampled_param_num(self):
-        assert 'weight' in self.samples.keys()
-        weight_numel = self.samples['weight'].numel()
+        assert self._sampled_weight is not None
+        weight_numel = self._sampled_weight.numel()
 
-        if self.samples['bias'] is not None:
-            bias_numel = self.samples['bias'].numel()
+        if self._sampled_bias is not None:
+            bias_numel = self._sampled_bias.numel()
         else:
             bias_numel = 0
 
@@ -75,13 +116,13 @@ class Conv2dSuper(nn.Conv2d):
 
 
 def sample_weight(weight, sample_in_dim, sample_out_dim):
-    sample_weight = weight[:, :sample_in_dim, :, :]
-    sample_weight = sample_weight[:sample_out_dim, :, :, :]
+    sample_weight = weight.narrow(0, 0, sample_out_dim)
+    sample_weight = sample_weight.narrow(1, 0, sample_in_dim)
 
     return sample_weight
 
 
 def sample_bias(bias, sample_out_dim):
-    sample_bias = bias[:sample_out_dim]
+    sample_bias = bias.narrow(0, 0, sample_out_dim)
 
     return sample_bias
@@ -186,6 +186,9 @@ def get_parser(desc, default_task='translation'):
     parser.add_argument('--fp16', action='store_true', help='use FP16')
     parser.add_argument('--memory-efficient-fp16', action='store_true',
                         help='use a memory-efficient version of FP16 training; implies --fp16')
+    parser.add_argument('--bf16', action='store_true',
+                        help='run the training forward pass under bfloat16 autocast, '
+                             'parameters and optimizer state stay in FP32')
     parser.add_argument('--fp16-init-scale', default=2 ** 7, type=int,
                         help='default FP16 loss scale')
     parser.add_argument('--fp16-scale-window', type=int,
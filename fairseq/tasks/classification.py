@@ -202,6 +202,7 @@ class ClassificationTask(FairseqTask):
         self, dataset, max_tokens=None, max_sentences=None, max_positions=None,
         ignore_invalid_inputs=False, required_batch_size_multiple=1,
         seed=1, num_shards=1, shard_id=0, num_workers=0, epoch=0,
+        pin_memory=False, prefetch_factor=None, persistent_workers=False,
     ):
         """
         Get an iterator that yields batches of data from the given dataset.
@@ -229,6 +230,12 @@ class ClassificationTask(FairseqTask):
                 (default: 0).
             epoch (int, optional): the epoch to start the iterator from
                 (default: 0).
+            pin_memory (bool, optional): load batches into pinned memory so
+                they can be copied to the GPU asynchronously (default: False).
+            prefetch_factor (int, optional): number of batches loaded in
+                advance by each worker (default: None).
+            persistent_workers (bool, optional): reuse the data loading
+                workers across unshuffled epochs (default: False).
 
         Returns:
             ~fairseq.iterators.EpochBatchIterator: a batched iterator over the
@@ -266,6 +273,9 @@ class ClassificationTask(FairseqTask):
             shard_id=shard_id,
             num_workers=num_workers,
             epoch=epoch,
+            pin_memory=pin_memory,
+            prefetch_factor=prefetch_factor,
+            persistent_workers=persistent_workers,
         )
 
 
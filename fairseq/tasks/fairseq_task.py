@@ -6,7 +6,7 @@
 import numpy as np
 import torch
 
-from fairseq import tokenizer
+from fairseq import tokenizer, utils
 from fairseq.data import data_utils, FairseqDataset, iterators, Dictionary
 
 
@@ -92,6 +92,7 @@ class FairseqTask(object):
         self, dataset, max_tokens=None, max_sentences=None, max_positions=None,
         ignore_invalid_inputs=False, required_batch_size_multiple=1,
         seed=1, num_shards=1, shard_id=0, num_workers=0, epoch=0,
+        pin_memory=False, prefetch_factor=None, persistent_workers=False,
     ):
         """
         Get an iterator that yields batches of data from the given dataset.
@@ -119,6 +120,12 @@ class FairseqTask(object):
                 (default: 0).
             epoch (int, optional): the epoch to start the iterator from
                 (default: 0).
+            pin_memory (bool, optional): load batches into pinned memory so
+                they can be copied to the GPU asynchronously (default: False).
+            prefetch_factor (int, optional): number of batches loaded in
+                advance by each worker (default: None).
+            persistent_workers (bool, optional): reuse the data loading
+                workers across unshuffled epochs (default: False).
 
         Returns:
             ~fairseq.iterators.EpochBatchIterator: a batched iterator over the
@@ -153,6 +160,9 @@ class FairseqTask(object):
             shard_id=shard_id,
             num_workers=num_workers,
             epoch=epoch,
+            pin_memory=pin_memory,
+            prefetch_factor=prefetch_factor,
+            persistent_workers=persistent_workers,
         )
 
     def build_model(self, args, fixed=False):
@@ -229,7 +239,9 @@ class FairseqTask(object):
                 - logging outputs to display while training
         """
         model.train()
-        loss, sample_size, logging_output = criterion(model, sample)
+        # only the forward runs under autocast, backward follows the dtypes it recorded
+        with utils.bf16_autocast(getattr(self.args, 'bf16', False)):
+            loss, sample_size, logging_output = criterion(model, sample)
         if ignore_grad:
             loss *= 0
         optimizer.backward(loss)
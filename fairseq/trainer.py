@@ -42,6 +42,12 @@ class Trainer(object):
         self._criterion = criterion
         self._model = model
         self.cuda = torch.cuda.is_available() and not args.cpu
+        if getattr(args, 'bf16', False):
+            assert not args.fp16, '--bf16 and --fp16 are mutually exclusive'
+            assert hasattr(torch, 'autocast') and hasattr(torch.cuda, 'is_bf16_supported'), \
+                '--bf16 requires PyTorch >= 1.10'
+            assert self.cuda and torch.cuda.is_bf16_supported(), \
+                '--bf16 requires a CUDA device with bfloat16 support'
         if args.fp16:
             self._criterion = self._criterion.half()
             self._model = self._model.half()
@@ -267,6 +273,7 @@ class Trainer(object):
             shard_id=self.args.distributed_rank,
             num_workers=self.args.num_workers,
             epoch=epoch,
+            pin_memory=self.cuda,
         )
 
     def train_step(self, samples, dummy_batch=False, raise_oom=False, configs=[None]):
@@ -63,7 +63,8 @@ def apply_to_sample(f, sample):
 def move_to_cuda(sample):
 
     def _move_to_cuda(tensor):
-        return tensor.cuda()
+        # only asynchronous when the batch was loaded into pinned memory
+        return tensor.cuda(non_blocking=True)
 
     return apply_to_sample(_move_to_cuda, sample)
 
@@ -361,6 +362,22 @@ def handle_save_path(args):
         os.makedirs(args.save_dir, exist_ok=True)
         args.tensorboard_logdir = os.path.join(args.save_dir, 'tensorboard')
 
+def inference_mode():
+    """torch.inference_mode() if this PyTorch has it, torch.no_grad() otherwise."""
+    if hasattr(torch, 'inference_mode'):
+        return torch.inference_mode()
+    return torch.no_grad()
+
+
+def bf16_autocast(enabled=True):
+    """CUDA bfloat16 autocast if *enabled*, a no-op context otherwise."""
+    if not enabled:
+        return contextlib.ExitStack()  # dummy contextmanager
+    if not hasattr(torch, 'autocast'):
+        raise RuntimeError('--bf16 requires torch.autocast, which needs PyTorch >= 1.10')
+    return torch.autocast(device_type='cuda', dtype=torch.bfloat16)
+
+
 @contextlib.contextmanager
 def eval(model):
     is_training = model.training
@@ -377,14 +394,20 @@ def has_parameters(module):
         return False
 
 
-def sample_configs(choices, reset_rand_seed, rand_seed=0, super_decoder_num_layer=6):
+def sample_configs(choices, reset_rand_seed, rand_seed=0, super_decoder_num_layer=6, rng=None):
     if 'encoder' not in choices and 'decoder' in choices:
-        return sample_configs_lm(choices, reset_rand_seed, rand_seed, super_decoder_num_layer)
+        return sample_configs_lm(choices, reset_rand_seed, rand_seed, super_decoder_num_layer, rng)
     if 'encoder' in choices and 'decoder' not in choices:
-        return sample_configs_classification(choices, reset_rand_seed, rand_seed, super_decoder_num_layer)
+        return sample_configs_classification(choices, reset_rand_seed, rand_seed, super_decoder_num_layer, rng)
     if reset_rand_seed:
         random.seed(rand_seed)
 
+    # the per-layer loops below run for every sampled arch, so keep the
+    # choice lists and random.choice in locals; *rng* replaces the global RNG
+    choice = (rng or random).choice
+    encoder_choices = choices['encoder']
+    decoder_choices = choices['decoder']
+
     config = {
         'encoder': {},
         'decoder': {}
@@ -394,30 +417,34 @@ def sample_configs(choices, reset_rand_seed, rand_seed=0, super_decoder_num_laye
                     'layer_num']
     for v in direct_select:
         for part in ['encoder', 'decoder']:
-            config[part][part+'_'+v] = random.choice(choices[part][part+'_'+v])
+            config[part][part+'_'+v] = choice(choices[part][part+'_'+v])
 
     # encoder
+    ffn_embed_dim_choice = encoder_choices['encoder_ffn_embed_dim']
+    self_attention_heads_choice = encoder_choices['encoder_self_attention_heads']
     encoder_ffn_embed_dim = []
     encoder_self_attention_heads = []
     for _ in range(config['encoder']['encoder_layer_num']):
-        encoder_ffn_embed_dim.append(random.choice(choices['encoder']['encoder_ffn_embed_dim']))
-        encoder_self_attention_heads.append(random.choice(choices['encoder']['encoder_self_attention_heads']))
+        encoder_ffn_embed_dim.append(choice(ffn_embed_dim_choice))
+        encoder_self_attention_heads.append(choice(self_attention_heads_choice))
 
     config['encoder']['encoder_ffn_embed_dim'] = encoder_ffn_embed_dim
     config['encoder']['encoder_self_attention_heads'] = encoder_self_attention_heads
 
+    ffn_embed_dim_choice = decoder_choices['decoder_ffn_embed_dim']
+    self_attention_heads_choice = decoder_choices['decoder_self_attention_heads']
+    ende_attention_heads_choice = decoder_choices['decoder_ende_attention_heads']
     decoder_ffn_embed_dim = []
     decoder_self_attention_heads = []
     decoder_ende_attention_heads = []
     for _ in range(config['decoder']['decoder_layer_num']):
-        decoder_ffn_embed_dim.append(random.choice(choices['decoder']['decoder_ffn_embed_dim']))
-        decoder_self_attention_heads.append(random.choice(choices['decoder']['decoder_self_attention_heads']))
-        decoder_ende_attention_heads.append(random.choice(choices['decoder']['decoder_ende_attention_heads']))
-    decoder_arbitrary_ende_attn_all = []
+        decoder_ffn_embed_dim.append(choice(ffn_embed_dim_choice))
+        decoder_self_attention_heads.append(choice(self_attention_heads_choice))
+        decoder_ende_attention_heads.append(choice(ende_attention_heads_choice))
 
     # every decoder layer need arbitrary_ende_attn setting, even if the layer will not be used
-    for _ in range(super_decoder_num_layer):
-        decoder_arbitrary_ende_attn_all.append(random.choice(choices['decoder']['decoder_arbitrary_ende_attn']))
+    arbitrary_ende_attn_choice = decoder_choices['decoder_arbitrary_ende_attn']
+    decoder_arbitrary_ende_attn_all = [choice(arbitrary_ende_attn_choice) for _ in range(super_decoder_num_layer)]
 
     config['decoder']['decoder_ffn_embed_dim'] = decoder_ffn_embed_dim
     config['decoder']['decoder_self_attention_heads'] = decoder_self_attention_heads
@@ -426,11 +453,14 @@ def sample_configs(choices, reset_rand_seed, rand_seed=0, super_decoder_num_laye
 
     return config
 
-def sample_configs_classification(choices, reset_rand_seed, rand_seed=0, super_decoder_num_layer=6):
+def sample_configs_classification(choices, reset_rand_seed, rand_seed=0, super_decoder_num_layer=6, rng=None):
 
     if reset_rand_seed:
         random.seed(rand_seed)
 
+    choice = (rng or random).choice
+    encoder_choices = choices['encoder']
+
     config = {
         'encoder': {}
     }
@@ -439,25 +469,31 @@ def sample_configs_classification(choices, reset_rand_seed, rand_seed=0, super_d
                     'layer_num']
     for v in direct_select:
         for part in ['encoder']:
-            config[part][part+'_'+v] = random.choice(choices[part][part+'_'+v])
+            config[part][part+'_'+v] = choice(choices[part][part+'_'+v])
 
     # encoder
+    ffn_embed_dim_choice = encoder_choices['encoder_ffn_embed_dim']
+    self_attention_heads_choice = encoder_choices['encoder_self_attention_heads']
+    attention_choices_choice = encoder_choices['encoder_attention_choices']
     encoder_ffn_embed_dim = []
     encoder_self_attention_heads = []
     encoder_attention_choices = []
     for _ in range(config['encoder']['encoder_layer_num']):
-        encoder_ffn_embed_dim.append(random.choice(choices['encoder']['encoder_ffn_embed_dim']))
-        encoder_self_attention_heads.append(random.choice(choices['encoder']['encoder_self_attention_heads']))
-        encoder_attention_choices.append(random.choice(choices['encoder']['encoder_attention_choices']))
+        encoder_ffn_embed_dim.append(choice(ffn_embed_dim_choice))
+        encoder_self_attention_heads.append(choice(self_attention_heads_choice))
+        encoder_attention_choices.append(choice(attention_choices_choice))
     config['encoder']['encoder_ffn_embed_dim'] = encoder_ffn_embed_dim
     config['encoder']['encoder_self_attention_heads'] = encoder_self_attention_heads
     config['encoder']['encoder_attention_choices'] = encoder_attention_choices
     return config
 
-def sample_configs_lm(choices, reset_rand_seed, rand_seed=0, super_decoder_num_layer=6):
+def sample_configs_lm(choices, reset_rand_seed, rand_seed=0, super_decoder_num_layer=6, rng=None):
     if reset_rand_seed:
         random.seed(rand_seed)
 
+    choice = (rng or random).choice
+    decoder_choices = choices['decoder']
+
     config = {
         'decoder': {}
     }
@@ -466,13 +502,15 @@ def sample_configs_lm(choices, reset_rand_seed, rand_seed=0, super_decoder_num_l
                     'layer_num']
     for v in direct_select:
         for part in ['decoder']:
-            config[part][part+'_'+v] = random.choice(choices[part][part+'_'+v])
+            config[part][part+'_'+v] = choice(choices[part][part+'_'+v])
 
+    ffn_embed_dim_choice = decoder_choices['decoder_ffn_embed_dim']
+    self_attention_heads_choice = decoder_choices['decoder_self_attention_heads']
     decoder_ffn_embed_dim = []
     decoder_self_attention_heads = []
     for _ in range(config['decoder']['decoder_layer_num']):
-        decoder_ffn_embed_dim.append(random.choice(choices['decoder']['decoder_ffn_embed_dim']))
-        decoder_self_attention_heads.append(random.choice(choices['decoder']['decoder_self_attention_heads']))
+        decoder_ffn_embed_dim.append(choice(ffn_embed_dim_choice))
+        decoder_self_attention_heads.append(choice(self_attention_heads_choice))
 
     config['decoder']['decoder_ffn_embed_dim'] = decoder_ffn_embed_dim
     config['decoder']['decoder_self_attention_heads'] = decoder_self_attention_heads
@@ -619,6 +657,13 @@ def get_config_features(config):
 
     return features
 
+def get_config_key(config):
+    """Turn a (nested) arch config into a hashable tuple, e.g. to deduplicate archs."""
+    return tuple(
+        (k, get_config_key(v) if isinstance(v, dict) else tuple(v) if isinstance(v, list) else v)
+        for k, v in sorted(config.items())
+    )
+
 def get_feature_info_lm():
     return ['decoder_embed_dim', 'decoder_layer_num', 'decoder_ffn_embed_dim_avg', 'decoder_self_attention_heads_avg']
 
@@ -765,9 +810,14 @@ def measure_latency(args, model, dummy_src_tokens, dummy_prev):
 
     model_test = copy.copy(model)
     model_test.set_sample_config(get_subtransformer_config(args))
-    src_tokens_test = torch.tensor([dummy_src_tokens], dtype=torch.long)
+    # the dummy inputs are either token lists or already (1 x len) LongTensors
+    if torch.is_tensor(dummy_src_tokens):
+        src_tokens_test = dummy_src_tokens
+        prev_output_tokens_test_with_beam = dummy_prev.repeat(args.beam, 1)
+    else:
+        src_tokens_test = torch.tensor([dummy_src_tokens], dtype=torch.long)
+        prev_output_tokens_test_with_beam = torch.tensor([dummy_prev] * args.beam, dtype=torch.long)
     src_lengths_test = torch.tensor([30])
-    prev_output_tokens_test_with_beam = torch.tensor([dummy_prev] * args.beam, dtype=torch.long)
 
     if args.latcpu:
         model_test.cpu()
@@ -15,7 +15,18 @@ from fairseq.data import LMContextWindowDataset
 from fairseq.sequence_scorer import SequenceScorer
 
 
+# FLOPs only depend on the sampled SubTransformer, so each one is traced at most once
+_flops_cache = {}
+
+
 def get_flops(args, task, model, config):
+    key = (args.arch, utils.get_config_key(config))
+    if key not in _flops_cache:
+        _flops_cache[key] = _profile_flops(args, task, model, config)
+    return _flops_cache[key]
+
+
+def _profile_flops(args, task, model, config):
     model.set_sample_config(config)
 
     if args.task == 'translation':
@@ -8,6 +8,7 @@ import collections
 
 import math
 import random
+import numpy as np
 import torch
 import pdb
 
@@ -17,7 +18,6 @@ from fairseq import checkpoint_utils, distributed_utils, options, progress_bar,
 from fairseq.data import iterators
 from fairseq.trainer import Trainer
 from fairseq.meters import AverageMeter, StopwatchMeter
-from copy import deepcopy
 
 
 def main(args, init_distributed=False):
@@ -30,6 +30,13 @@ def main(args, init_distributed=False):
     # Initialize CUDA and distributed training
     if torch.cuda.is_available() and not args.cpu:
         torch.cuda.set_device(args.device_id)
+        # a single SubTransformer keeps its shapes for the whole run, so cuDNN can autotune
+        # for them; the SuperTransformer changes shapes every batch and would keep re-tuning
+        if args.train_subtransformer:
+            torch.backends.cudnn.benchmark = True
+        # TF32 tensor cores (Ampere and newer) for FP32 matmuls
+        if torch.cuda.get_device_capability()[0] >= 8:
+            torch.backends.cuda.matmul.allow_tf32 = True
     torch.manual_seed(args.seed)
     if init_distributed:
         args.distributed_rank = distributed_utils.distributed_init(args)
@@ -98,8 +105,10 @@ def main(args, init_distributed=False):
     elif args.task == 'language_modeling':
         dummy_sentence_length = args.max_tokens
     if args.task != 'classification':
-        dummy_src_tokens = [2] + [7] * (dummy_sentence_length - 1)
-        dummy_prev = [7] * (dummy_sentence_length - 1) + [2]
+        dummy_src_tokens = torch.full((1, dummy_sentence_length), 7, dtype=torch.long)
+        dummy_src_tokens[0, 0] = 2
+        dummy_prev = torch.full((1, dummy_sentence_length), 7, dtype=torch.long)
+        dummy_prev[0, -1] = 2
     elif args.task == 'classification':
         dummy_src_tokens = torch.randn(1, 3, 224, 224)
         dummy_prev = None
@@ -110,14 +119,14 @@ def main(args, init_distributed=False):
         model.set_sample_config(config_subtransformer)
         model.profile(mode=True)
         if args.task == 'classification':
-            macs = torchprofile.profile_macs(model, args=(dummy_src_tokens))
+            with utils.inference_mode():
+                macs = torchprofile.profile_macs(model, args=(dummy_src_tokens))
             model.profile(mode=False)
             last_layer_macs = 0
         else:
-            macs = torchprofile.profile_macs(model, args=(
-                torch.tensor([dummy_src_tokens],
-                             dtype=torch.long), torch.tensor([30]),
-                torch.tensor([dummy_prev], dtype=torch.long)))
+            with utils.inference_mode():
+                macs = torchprofile.profile_macs(model, args=(
+                    dummy_src_tokens, torch.tensor([30]), dummy_prev))
             model.profile(mode=False)
 
             last_layer_macs = config_subtransformer['decoder']['decoder_embed_dim'] * dummy_sentence_length * len(
@@ -159,36 +168,48 @@ def main(args, init_distributed=False):
     train_meter.start()
     valid_subsets = args.valid_subset.split(',')
 
+    # both only depend on args, compute them once for the whole run
+    all_choices = utils.get_all_choices(args)
     represent_configs = utils.get_represent_configs(args)
+    # build the validation iterators once so every validation reuses the same workers;
+    # the ranking only uses (a shard of) the first subset
+    valid_itrs = {
+        subset: get_valid_iterator(args, trainer, task, subset)
+        for subset in valid_subsets
+    }
+    if args.rank_valid_shards > 1:
+        rank_valid_itr = get_valid_iterator(
+            args, trainer, task, valid_subsets[0], num_shards=args.rank_valid_shards, shard_id=0)
+    else:
+        rank_valid_itr = valid_itrs[valid_subsets[0]]
 
     sampled_archs = []
-    hash_tables = []
+    hash_tables = set()
 
     while len(sampled_archs) < args.rank_list_size:
         sample = utils.sample_configs(
-            utils.get_all_choices(args),
+            all_choices,
             reset_rand_seed=False,
             super_decoder_num_layer=args.decoder_layers
         )
-        if str(sample) not in hash_tables:
+        key = utils.get_config_key(sample)
+        if key not in hash_tables:
             sampled_archs.append(sample)
-            hash_tables.append(str(sample))
-    prev_loss = [i * 0.01 for i in range(args.rank_list_size)]
+            hash_tables.add(key)
+    prev_loss = np.arange(args.rank_list_size) * 0.01
     corr = -1.0
 
     def get_rank_corr(prev_corr_, prev_loss_):
-        losses = []
-        for i, arch in enumerate(sampled_archs):
-            trainer.set_sample_config(config=arch)
-            valid_losses = validate(
-                args, trainer, task, epoch_itr, valid_subsets, str(i))
-            losses.append(valid_losses[0])
-            del valid_losses
+        # the ranking only uses the first validation subset, evaluate all archs on it in one pass;
+        # every arch and every round sees the same shard, so the losses stay comparable
+        losses = validate_archs(
+            args, trainer, task, epoch_itr, valid_subsets[0], sampled_archs, rank_valid_itr)
         corr = kendalltau(losses, prev_loss_)[0]
-        spearman_corr = spearmanr(losses, prev_loss_)[0]
         is_ranking_stable = corr > prev_corr_
 
-        print('current spearman corr:', spearman_corr)
+        # only kendalltau drives early stopping, spearman is for logging only
+        if args.log_spearman_corr:
+            print('current spearman corr:', spearmanr(losses, prev_loss_)[0])
         print('current kendalltau corr:', corr)
 
         return is_ranking_stable, corr, losses
@@ -200,7 +221,7 @@ def main(args, init_distributed=False):
     while not stop_training and lr > args.min_lr and epoch_itr.epoch < max_epoch and trainer.get_num_updates() < max_update:
 
         # train for one epoch
-        train(args, trainer, task, epoch_itr)
+        train(args, trainer, task, epoch_itr, all_choices, represent_configs, valid_itrs)
 
         # apply early stopping if the ranking corr doesn't change for multiple rounds
         if args.task != 'classification':
@@ -221,7 +242,8 @@ def main(args, init_distributed=False):
             for k, v in represent_configs.items():
                 trainer.set_sample_config(config=v)
                 valid_losses = validate(
-                    args, trainer, task, epoch_itr, valid_subsets, sampled_arch_name=k)
+                    args, trainer, task, epoch_itr, valid_subsets, sampled_arch_name=k,
+                    valid_itrs=valid_itrs)
         else:
             valid_losses = [None]
         
@@ -237,7 +259,7 @@ def main(args, init_distributed=False):
     print('| Done training in {:.1f} seconds'.format(train_meter.sum))
 
 
-def train(args, trainer, task, epoch_itr):
+def train(args, trainer, task, epoch_itr, all_choices, represent_configs, valid_itrs):
     """Train the model for one epoch."""
     # Update parameters every N batches
     update_freq = args.update_freq[epoch_itr.epoch - 1] \
@@ -254,44 +276,47 @@ def train(args, trainer, task, epoch_itr):
     )
 
     extra_meters = collections.defaultdict(lambda: AverageMeter())
+    logged_keys = frozenset(['loss', 'nll_loss', 'ntokens', 'nsentences', 'sample_size'])
     valid_subsets = args.valid_subset.split(',')
 
     max_update = args.max_update or math.inf
 
-    represent_configs = utils.get_represent_configs(args)
+    if not args.train_subtransformer:
+        # sample the SubTransformers of the epoch from one RNG seeded at its start instead
+        # of reseeding the global RNG for every batch
+        sample_fn = utils.sample_configs_lm if args.task == 'language_modeling' else utils.sample_configs
+        arch_rng = random.Random(trainer.get_num_updates())
+        arch_update, arch_config = None, None
+
     for i, samples in enumerate(progress, start=epoch_itr.iterations_in_epoch):
 
         if args.train_subtransformer:
             # training one SubTransformer only
             configs = [utils.get_subtransformer_config(args)]
         else:
-            # training SuperTransformer by randomly sampling SubTransformers
-            if args.task == 'translation':
-                configs = [utils.sample_configs(utils.get_all_choices(args), reset_rand_seed=True,
-                                                rand_seed=trainer.get_num_updates(),
-                                                super_decoder_num_layer=args.decoder_layers)]
-            elif args.task == 'language_modeling':
-                configs = [utils.sample_configs_lm(utils.get_all_choices(args), reset_rand_seed=True,
-                                                   rand_seed=trainer.get_num_updates(),
-                                                   super_decoder_num_layer=args.decoder_layers)]
-            elif args.task == 'classification':
-                configs = [utils.sample_configs(utils.get_all_choices(args), reset_rand_seed=True,
-                                                rand_seed=trainer.get_num_updates(),
-                                                super_decoder_num_layer=args.decoder_layers)]
+            # training SuperTransformer by randomly sampling SubTransformers; a batch whose
+            # update was skipped is retried with the same SubTransformer
+            if trainer.get_num_updates() != arch_update:
+                arch_update = trainer.get_num_updates()
+                arch_config = sample_fn(all_choices, reset_rand_seed=False,
+                                        super_decoder_num_layer=args.decoder_layers, rng=arch_rng)
+            configs = [arch_config]
         log_output = trainer.train_step(samples, configs=configs)
         if log_output is None:
             continue
 
         # log mid-epoch stats
         stats = utils.get_training_stats(trainer)
+        sample_size = log_output['sample_size']
         for k, v in log_output.items():
-            if k in ['loss', 'nll_loss', 'ntokens', 'nsentences', 'sample_size']:
+            if k in logged_keys:
                 continue  # these are already logged above
+            meter = extra_meters[k]
             if 'loss' in k or k == 'accuracy':
-                extra_meters[k].update(v, log_output['sample_size'])
+                meter.update(v, sample_size)
             else:
-                extra_meters[k].update(v)
-            stats[k] = extra_meters[k].avg
+                meter.update(v)
+            stats[k] = meter.avg
 
         utils.log_arch_info(stats, configs[0])
 
@@ -311,7 +336,8 @@ def train(args, trainer, task, epoch_itr):
             for k, v in represent_configs.items():
                 trainer.set_sample_config(config=v)
                 valid_losses = validate(
-                    args, trainer, task, epoch_itr, valid_subsets, sampled_arch_name=k)
+                    args, trainer, task, epoch_itr, valid_subsets, sampled_arch_name=k,
+                    valid_itrs=valid_itrs)
 
             checkpoint_utils.save_checkpoint(
                 args, trainer, epoch_itr, valid_losses[0])
@@ -333,27 +359,47 @@ def train(args, trainer, task, epoch_itr):
             meter.reset()
 
 
-def validate(args, trainer, task, epoch_itr, subsets, sampled_arch_name):
-    """Evaluate the model on the validation set(s) and return the losses."""
+def get_valid_iterator(args, trainer, task, subset, num_shards=1, shard_id=0):
+    """Build a reusable batch iterator over a validation subset.
+
+    On top of the distributed sharding, the subset can be split into
+    *num_shards* pieces of which only *shard_id* is iterated.
+    """
+    return task.get_batch_iterator(
+        dataset=task.dataset(subset),
+        max_tokens=args.max_tokens_valid,
+        max_sentences=args.max_sentences_valid,
+        max_positions=utils.resolve_max_positions(
+            task.max_positions(),
+            trainer.get_model().max_positions(),
+        ),
+        ignore_invalid_inputs=args.skip_invalid_size_inputs_valid_test,
+        required_batch_size_multiple=args.required_batch_size_multiple,
+        seed=args.seed,
+        num_shards=args.distributed_world_size * num_shards,
+        shard_id=shard_id * args.distributed_world_size + args.distributed_rank,
+        num_workers=args.num_workers,
+        pin_memory=trainer.cuda,
+        prefetch_factor=4,
+        persistent_workers=True,
+    )
+
+
+def validate(args, trainer, task, epoch_itr, subsets, sampled_arch_name, valid_itrs=None):
+    """Evaluate the model on the validation set(s) and return the losses.
+
+    *valid_itrs* optionally maps subset names to iterators built with
+    :func:`get_valid_iterator`, which are then reused instead of rebuilt.
+    """
     valid_losses = []
     for subset in subsets:
         # Initialize data iterator
         def get_itr():
-            itr = task.get_batch_iterator(
-                dataset=task.dataset(subset),
-                max_tokens=args.max_tokens_valid,
-                max_sentences=args.max_sentences_valid,
-                max_positions=utils.resolve_max_positions(
-                    task.max_positions(),
-                    trainer.get_model().max_positions(),
-                ),
-                ignore_invalid_inputs=args.skip_invalid_size_inputs_valid_test,
-                required_batch_size_multiple=args.required_batch_size_multiple,
-                seed=args.seed,
-                num_shards=args.distributed_world_size,
-                shard_id=args.distributed_rank,
-                num_workers=args.num_workers,
-            ).next_epoch_itr(shuffle=False)
+            if valid_itrs is not None and subset in valid_itrs:
+                batch_itr = valid_itrs[subset]
+            else:
+                batch_itr = get_valid_iterator(args, trainer, task, subset)
+            itr = batch_itr.next_epoch_itr(shuffle=False)
             progress = progress_bar.build_progress_bar(
                 args, itr, epoch_itr.epoch,
                 prefix='valid on \'{}\' subset'.format(subset),
@@ -370,13 +416,14 @@ def validate(args, trainer, task, epoch_itr, subsets, sampled_arch_name):
                 meter.reset()
         extra_meters = collections.defaultdict(lambda: AverageMeter())
 
-        for sample in progress:
-            log_output = trainer.valid_step(sample)
+        with utils.inference_mode():
+            for sample in progress:
+                log_output = trainer.valid_step(sample)
 
-            for k, v in log_output.items():
-                if k in ['loss', 'nll_loss', 'ntokens', 'nsentences', 'sample_size']:
-                    continue
-                extra_meters[k].update(v)
+                for k, v in log_output.items():
+                    if k in ['loss', 'nll_loss', 'ntokens', 'nsentences', 'sample_size']:
+                        continue
+                    extra_meters[k].update(v)
 
         # log validation stats
         stats = utils.get_valid_stats(trainer, args)
@@ -386,10 +433,11 @@ def validate(args, trainer, task, epoch_itr, subsets, sampled_arch_name):
         # log validation stats
         stats = utils.get_valid_stats(trainer, args, extra_meters)
 
-        stats[sampled_arch_name + '_loss'] = deepcopy(stats['loss'])
-        stats[sampled_arch_name + '_nll_loss'] = deepcopy(stats['nll_loss'])
-        stats[sampled_arch_name + '_acc1'] = deepcopy(stats['valid_acc1'])
-        stats[sampled_arch_name + '_acc5'] = deepcopy(stats['valid_acc5'])
+        # the meters are printed right below, before anything can reset them
+        stats[sampled_arch_name + '_loss'] = stats['loss']
+        stats[sampled_arch_name + '_nll_loss'] = stats['nll_loss']
+        stats[sampled_arch_name + '_acc1'] = stats['valid_acc1']
+        stats[sampled_arch_name + '_acc5'] = stats['valid_acc5']
         for k, meter in extra_meters.items():
             stats[k] = meter.avg
 
@@ -403,6 +451,62 @@ def validate(args, trainer, task, epoch_itr, subsets, sampled_arch_name):
     return valid_losses
 
 
+def validate_archs(args, trainer, task, epoch_itr, subset, archs, valid_itr):
+    """Evaluate several SubTransformers on one validation subset in a single pass.
+
+    Every batch is moved to the device once and then evaluated by each arch in
+    turn, so the data loading cost does not grow with the number of archs.
+    *valid_itr* is the :func:`get_valid_iterator` iterator over *subset* (or
+    a shard of it). Returns the *best_checkpoint_metric* of every arch.
+    """
+    progress = progress_bar.build_progress_bar(
+        args, valid_itr.next_epoch_itr(shuffle=False), epoch_itr.epoch,
+        prefix='valid on \'{}\' subset'.format(subset),
+        no_progress_bar='simple'
+    )
+
+    loss_meters = [AverageMeter() for _ in archs]
+    nll_loss_meters = [AverageMeter() for _ in archs]
+    with utils.inference_mode():
+        for sample in progress:
+            if trainer.cuda:
+                sample = utils.move_to_cuda(sample)
+            for arch, loss_meter, nll_loss_meter in zip(archs, loss_meters, nll_loss_meters):
+                trainer.set_sample_config(config=arch)
+                log_output = trainer.valid_step(sample)
+
+                sample_size = log_output.get('sample_size', 0)
+                if sample_size > 0:
+                    loss_meter.update(log_output.get('loss', 0), sample_size)
+                if 'nll_loss' in log_output and log_output.get('ntokens', 0) > 0:
+                    nll_loss_meter.update(log_output['nll_loss'], log_output['ntokens'])
+
+    stats = collections.OrderedDict()
+    valid_losses = np.empty(len(archs))
+    for i, (loss_meter, nll_loss_meter) in enumerate(zip(loss_meters, nll_loss_meters)):
+        nll_loss = nll_loss_meter.avg if nll_loss_meter.count > 0 else loss_meter.avg
+        if args.best_checkpoint_metric == 'loss':
+            valid_losses[i] = loss_meter.avg
+        elif args.best_checkpoint_metric == 'nll_loss':
+            valid_losses[i] = nll_loss
+        elif args.best_checkpoint_metric == 'ppl':
+            # get_perplexity returns a formatted string
+            valid_losses[i] = float(utils.get_perplexity(nll_loss))
+        else:
+            raise ValueError('best_checkpoint_metric not found in logs')
+        stats[str(i) + '_loss'] = loss_meter.avg
+        stats[str(i) + '_nll_loss'] = nll_loss
+
+    progress.print(stats, tag=subset, step=trainer.get_num_updates())
+
+    # valid_step accumulated every arch into the trainer's meters, don't leave that mix behind
+    for k in ['valid_loss', 'valid_nll_loss']:
+        meter = trainer.get_meter(k)
+        if meter is not None:
+            meter.reset()
+    return valid_losses
+
+
 def distributed_main(i, args, start_rank=0):
     args.device_id = i
     if args.distributed_rank is None:  # torch.multiprocessing.spawn
@@ -440,6 +544,10 @@ def cli_main():
                         default=0.9, help='the threshold of ranking correlation')
     parser.add_argument('--rank-list-size', type=int, default=200,
                         help='candidate rank list size for validation')
+    parser.add_argument('--rank-valid-shards', type=int, default=1,
+                        help='only use 1/N of the validation set when ranking the candidates')
+    parser.add_argument('--log-spearman-corr', action='store_true',
+                        help='also compute and print the spearman corr of the ranking')
     parser.add_argument('--loss', type=float, default=0,
                         help='the expected validation loss')
     parser.add_argument('--max-batch', type=int, default=9000,